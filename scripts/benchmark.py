@@ -0,0 +1,395 @@
+"""
+Benchmarks of the ingestion, binarization and transformer hot paths. The data is
+synthetic and generated at a configurable scale. Every benchmark runs in its own
+process, and inside a temporary directory so the '../data' paths of the scripts
+don't touch the real dataset. The peak memory is reset when the timed section
+starts, so generating the data is not counted.
+
+In the postgres mode, process_tweet inserts to the local database and commits
+every tweet like the real ingestion, but into an empty copy of the tweets table
+in a bench schema. The schema is dropped at the end.
+
+The results are saved as JSON and two runs can be compared to find regressions.
+
+Usage: python benchmark.py run [scale] [output.json] [postgres]
+       python benchmark.py compare <old.json> <new.json>
+"""
+
+import io
+import os
+import sys
+import json
+import shutil
+import tempfile
+import datetime
+import itertools as it
+import multiprocessing as mp
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+
+import helpers
+import profiling
+
+
+words = ['the', 'and', 'you', 'that', 'was', 'for', 'are', 'with', 'his', 'they', 'this', 'have', 'from',
+         'one', 'had', 'word', 'but', 'not', 'what', 'all', 'were', 'when', 'your', 'can', 'said', 'there']
+
+
+class StubDatabase:
+    """ Stands in for the database connection and the cursor. Nothing is stored. """
+
+    def cursor(self):
+        return self
+
+    def execute(self, query, values=None):
+        pass
+
+    def commit(self):
+        pass
+
+
+def open_bench_database():
+    """ Connect to the local database and make the bench schema with an empty copy of the
+        tweets table. The unqualified tweets table of the connection is the copy. """
+
+    import psycopg2 as pg
+
+    db = pg.connect(host='localhost')
+    cur = db.cursor()
+
+    cur.execute('DROP SCHEMA IF EXISTS bench CASCADE')
+    cur.execute('CREATE SCHEMA bench')
+    cur.execute('CREATE TABLE bench.tweets (LIKE public.tweets INCLUDING ALL)')
+
+    # the copied default would take the ids from the sequence of the real table
+    cur.execute('CREATE SEQUENCE bench.tweets_id_seq OWNED BY bench.tweets.id')
+    cur.execute("ALTER TABLE bench.tweets ALTER COLUMN id SET DEFAULT nextval('bench.tweets_id_seq')")
+
+    cur.execute('SET search_path TO bench')
+    db.commit()
+
+    return db
+
+
+def close_bench_database(db):
+    """ Drop the bench schema and close the connection. """
+
+    db.rollback()
+    db.cursor().execute('DROP SCHEMA bench CASCADE')
+    db.commit()
+    db.close()
+
+
+section = {}
+
+
+def start_section():
+    """ Start the timed section of a benchmark. The memory is measured from here. """
+
+    section['rss before mb'] = profiling.current_rss_mb()
+    section['peak includes setup'] = not profiling.reset_peak_rss()
+
+    return timer()
+
+
+def generate_tweet_dump(filename, tweets, users, random):
+    """ Write a dump with T/U/W records in the same format as the dataset. """
+
+    with helpers.TweetWriter(filename, header=True) as writer:
+        for timestamp, user, content in generate_tweets(tweets, users, random):
+            writer.write(timestamp, user, content)
+
+
+def generate_tweets(tweets, users, random):
+    """ A generator of random tweets with hashtags, mentions and urls. """
+
+    start = datetime.datetime(2009, 6, 1)
+
+    for i in range(tweets):
+        content = list(random.choice(words, random.randint(3, 15)))
+        if random.rand() < .3:
+            content.append('#tag%d' % random.randint(100))
+        if random.rand() < .3:
+            content.append('@user%d' % random.randint(users))
+        if random.rand() < .2:
+            content.append('http://bit.ly/%d' % random.randint(1000))
+
+        timestamp = start + datetime.timedelta(seconds=int(random.randint(14 * 7 * 24 * 3600)))
+        user = 'http://twitter.com/user%d' % random.randint(users)
+
+        yield timestamp, user, ' '.join(content)
+
+
+def generate_pivot_week(users, week, random):
+    """ Make one week of the pivot table in the form process_chunk_week gets it. """
+
+    def make_lists(prefix, values, probability):
+        return [','.join('%s%d' % (prefix, v) for v in random.randint(values, size=random.randint(1, 4)))
+                if random.rand() < probability else np.nan for _ in range(users)]
+
+    data = pd.DataFrame({
+        'tweets': random.poisson(2, users),
+        'hashtags': make_lists('tag', 200, .3),
+        'mentions': make_lists('user', 500, .3),
+        'urls': make_lists('bit.ly/', 100, .2),
+    }, index=['user%d' % i for i in range(users)])
+    data.columns = pd.MultiIndex.from_product([[str(week)], data.columns])
+
+    return data.to_sparse(0)
+
+
+def generate_binarized(users, dummies, random, weeks=range(23, 37)):
+    """ Make a frame like binarized_data.pkl with (week, column) columns. """
+
+    frames = []
+    for week in weeks:
+        data = pd.DataFrame((random.rand(users, dummies) < .05).astype(float),
+                            columns=['hashtag_tag%d' % i for i in range(dummies)])
+        for column in ['tweets', 'other_hashtags', 'other_mentions', 'other_urls']:
+            data[column] = random.poisson(2, users).astype(float)
+        frames.append(data)
+
+    return pd.concat(frames, axis=1, keys=list(weeks))
+
+
+def bench_lazy_read_tweets(scale, random, postgres):
+    tweets = 10000 * scale
+    generate_tweet_dump('tweets.txt', tweets, 1000 * scale, random)
+
+    start = start_section()
+    for _ in it.islice(helpers.lazy_read_tweets('tweets.txt'), tweets):
+        pass
+
+    return timer() - start, tweets
+
+
+def bench_write_tweet(scale, random, postgres):
+    tweets = 10000 * scale
+    records = list(generate_tweets(tweets, 1000 * scale, random))
+
+    start = start_section()
+    for timestamp, user, content in records:
+        helpers.write_tweet('tweets.txt', timestamp, user, content)
+
+    return timer() - start, tweets
+
+
+def bench_tweet_writer(scale, random, postgres):
+    tweets = 10000 * scale
+    records = list(generate_tweets(tweets, 1000 * scale, random))
+
+    start = start_section()
+    with helpers.TweetWriter('tweets.txt', header=True) as writer:
+        for timestamp, user, content in records:
+            writer.write(timestamp, user, content)
+
+    return timer() - start, tweets
+
+
+def bench_lazy_read_raw_tweets(scale, random, postgres):
+    tweets = 10000 * scale
+    generate_tweet_dump('tweets.txt', tweets, 1000 * scale, random)
+
+    start = start_section()
+    for _ in helpers.lazy_read_raw_tweets('tweets.txt'):
+        pass
+
+    return timer() - start, tweets
+
+
+def bench_process_tweet(scale, random, postgres):
+    import process_dataset
+
+    tweets = 2000 * scale
+    generate_tweet_dump('tweets.txt', tweets, 1000 * scale, random)
+
+    process_dataset.processed_count = mp.Value('i', 0)
+    process_dataset.inserted_count = mp.Value('i', 0)
+    process_dataset.errored_count = mp.Value('i', 0)
+
+    process_dataset.db = open_bench_database() if postgres else StubDatabase()
+
+    records = list(it.islice(helpers.lazy_read_tweets('tweets.txt'), tweets))
+
+    try:
+        start = start_section()
+        for tweet in records:
+            process_dataset.process_tweet(tweet)
+        seconds = timer() - start
+    finally:
+        if postgres:
+            close_bench_database(process_dataset.db)
+
+    return seconds, tweets, {
+        'inserted count': process_dataset.inserted_count.value,
+        'errored count': process_dataset.errored_count.value,
+    }
+
+
+def bench_process_chunk_week(scale, random, postgres):
+    import binarizer
+
+    users = 2000 * scale
+    chunk = generate_pivot_week(users, 23, random)
+
+    start = start_section()
+    binarizer.process_chunk_week(chunk, 0, 23, 10)
+
+    return timer() - start, users
+
+
+def bench_merge_chunks(scale, random, postgres):
+    import binarizer
+
+    users = 2000
+    chunks = 2 * scale
+
+    for chunk_number in range(chunks):
+        for week in range(23, 37):
+            binarizer.process_chunk_week(generate_pivot_week(users, week, random), chunk_number, week, 10)
+
+    start = start_section()
+    binarizer.merge_chunks()
+
+    return timer() - start, users * chunks
+
+
+def bench_transformer(make_transformer, fit):
+    """ Make a benchmark of a binarized_transforms transformer. """
+
+    def bench(scale, random, postgres):
+        users = 2000 * scale
+        data = generate_binarized(users, 50, random)
+        target = random.rand(users) < .5
+        transformer = make_transformer()
+
+        start = start_section()
+        if fit:
+            transformer.fit(data, target)
+        transformer.transform(data)
+
+        return timer() - start, users
+
+    return bench
+
+
+def make_benchmarks():
+    """ Get the benchmarks by name. """
+
+    import binarized_transforms as bt
+
+    return {
+        'helpers.lazy_read_tweets': bench_lazy_read_tweets,
+        'helpers.lazy_read_raw_tweets': bench_lazy_read_raw_tweets,
+        'helpers.write_tweet': bench_write_tweet,
+        'helpers.TweetWriter': bench_tweet_writer,
+        'process_dataset.process_tweet': bench_process_tweet,
+        'binarizer.process_chunk_week': bench_process_chunk_week,
+        'binarizer.merge_chunks': bench_merge_chunks,
+        'TargetMaker': bench_transformer(lambda: bt.TargetMaker(36), False),
+        'ClassBalancer': bench_transformer(lambda: bt.ClassBalancer(), True),
+        'Normalizer': bench_transformer(lambda: bt.Normalizer(), True),
+        'Normalizer (all columns)': bench_transformer(lambda: bt.Normalizer(ignore_binarized_columns=False), True),
+        'TimeDecayApplier': bench_transformer(lambda: bt.TimeDecayApplier(36), False),
+        'WeeksLimiter': bench_transformer(lambda: bt.WeeksLimiter(30, 36), False),
+    }
+
+
+def run_benchmark(name, scale, postgres):
+    """ Run one benchmark in a temporary directory. This function is run by a new process. """
+
+    root = tempfile.mkdtemp()
+    cwd = os.getcwd()
+
+    try:
+        # the scripts use paths relative to the working directory
+        os.makedirs(os.path.join(root, 'data', 'chunks'))
+        os.makedirs(os.path.join(root, 'work'))
+        os.chdir(os.path.join(root, 'work'))
+
+        result = make_benchmarks()[name](scale, np.random.RandomState(0), postgres)
+        peak = profiling.peak_rss_mb()
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+    seconds, items = result[:2]
+
+    results = {
+        'seconds': seconds,
+        'items': items,
+        'items per second': items / seconds if seconds > 0 else 0,
+        'rss before mb': section['rss before mb'],
+        'peak rss mb': peak,
+        'peak rss increase mb': peak - section['rss before mb'],
+        'peak includes setup': section['peak includes setup'],
+    }
+    results.update(result[2] if len(result) > 2 else {})
+
+    return results
+
+
+def run(scale=1, output_file=None, postgres=False):
+    """ Run all benchmarks and save the results as JSON. """
+
+    if output_file is None:
+        output_file = datetime.datetime.now().strftime('benchmark_%Y%m%d_%H%M%S.json')
+
+    results = {}
+    for name in make_benchmarks():
+        print('Running %s' % name)
+
+        # a new process for every benchmark, so the memory of the others doesn't count
+        with mp.Pool(1) as pool:
+            results[name] = pool.apply(run_benchmark, (name, scale, postgres))
+
+        print('%s took %.3f seconds, %.1f items per second, peak RSS %.1f MB (+%.1f MB)' %
+              (name, results[name]['seconds'], results[name]['items per second'], results[name]['peak rss mb'],
+               results[name]['peak rss increase mb']))
+
+        if results[name].get('errored count'):
+            print('Warning: %s had %d errors, the throughput is not comparable' %
+                  (name, results[name]['errored count']))
+
+    with io.open(output_file, mode='w') as file:
+        json.dump({'time': datetime.datetime.now().isoformat(), 'scale': scale, 'results': results}, file, indent=2)
+
+    print('Saved the results to ' + output_file)
+
+
+def compare(old_file, new_file, threshold=.1):
+    """ Compare the throughput of two runs and print the regressions. """
+
+    with io.open(old_file) as file:
+        old = json.load(file)
+    with io.open(new_file) as file:
+        new = json.load(file)
+
+    if old['scale'] != new['scale']:
+        print('Warning: the runs have different scales (%s and %s)' % (old['scale'], new['scale']))
+
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            print('%-32s new' % name)
+            continue
+
+        old_result = old['results'][name]
+        ratio = result['items per second'] / old_result['items per second'] if old_result['items per second'] else 0
+        memory = result['peak rss increase mb'] - old_result['peak rss increase mb']
+        flag = 'REGRESSION' if ratio < 1 - threshold else ''
+
+        print('%-32s throughput %6.2fx, peak RSS increase %+8.1f MB %s' % (name, ratio, memory, flag))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'run':
+        run(int(sys.argv[2]) if len(sys.argv) >= 3 else 1,
+            sys.argv[3] if len(sys.argv) >= 4 else None,
+            len(sys.argv) >= 5 and sys.argv[4] == 'postgres')
+
+    elif len(sys.argv) >= 4 and sys.argv[1] == 'compare':
+        compare(sys.argv[2], sys.argv[3])
+
+    else:
+        print(__doc__)
@@ -57,48 +57,96 @@ class ClassBalancer(BaseEstimator, TransformerMixin):
 
 class Normalizer(BaseEstimator, TransformerMixin):
     """ Normalizes the dataset so the sums per week are 1. Only normalizes
-        columns that contain actual counts and ignores the binary columns. """
+        columns that contain actual counts and ignores the binary columns.
+
+        The column sums are stored in a NumPy array aligned with the columns
+        index. Normalizers fitted on different chunks (or in different processes)
+        can be combined with merge. """
 
     def __init__(self, ignore_binarized_columns=True, verbose=False, skip=False):
         self.ignore_binarized_columns = ignore_binarized_columns
         self.verbose = verbose
-        self.column_sums = {}
+        self.columns = None
+        self.column_sums = None
         self.skip = skip
 
+    def columns_to_process(self, data):
+        """ Get the (week, column) pairs that should be normalized. """
+
+        if not self.ignore_binarized_columns:
+            return data.columns
+
+        return data.columns[data.columns.get_level_values(1).isin(
+            ['tweets', 'other_hashtags', 'other_mentions', 'other_urls'])]
+
     def fit(self, data, target=None):
+        self.columns = None
+        self.column_sums = None
+
+        return self.partial_fit(data, target)
+
+    def partial_fit(self, data, target=None):
+        """ Add the column sums of another part of the dataset to the stored sums.
+            Used for fitting the statistics chunk by chunk. """
+
         if self.skip:
             return self
 
-        for week in data.columns.get_level_values(0):
-            columns_to_process = ['tweets', 'other_hashtags', 'other_mentions', 'other_urls'] if \
-                self.ignore_binarized_columns else \
-                data.loc[:, [week]].columns.get_level_values(1)
+        columns = self.columns_to_process(data)
 
-            for column in columns_to_process:
-                if self.verbose:
-                    print('Summing column', week, column)
+        if self.verbose:
+            print('Summing %d columns' % len(columns))
+
+        return self.add_sums(columns, data[columns].sum().values.astype(float))
 
-                self.column_sums[(week, column)] = data[(week, column)].sum()
+    def add_sums(self, columns, sums):
+        """ Add the sums of the given columns to the stored sums. New columns are appended. """
+
+        if self.columns is None:
+            self.columns = columns
+            self.column_sums = sums.copy()
+        elif self.columns.equals(columns):
+            self.column_sums += sums
+        else:
+            merged_columns = self.columns.union(columns)
+            merged_sums = np.zeros(len(merged_columns))
+            merged_sums[merged_columns.get_indexer(self.columns)] += self.column_sums
+            merged_sums[merged_columns.get_indexer(columns)] += sums
+
+            self.columns = merged_columns
+            self.column_sums = merged_sums
 
         return self
 
+    def merge(self, other):
+        """ Add the sums of another fitted normalizer to this one. Can be used with
+            functools.reduce to combine normalizers fitted on parts of the dataset. """
+
+        if other.columns is None:
+            return self
+
+        return self.add_sums(other.columns, other.column_sums)
+
     def transform(self, data):
         if self.skip:
             return data
 
         data = data.copy(deep=False)
 
-        for week in data.columns.get_level_values(0):
-            columns_to_process = ['tweets', 'other_hashtags', 'other_mentions', 'other_urls'] if \
-                self.ignore_binarized_columns else \
-                data.loc[:, [week]].columns.get_level_values(1)
+        columns = self.columns_to_process(data)
+        indices = self.columns.get_indexer(columns)
 
-            for column in columns_to_process:
-                if self.verbose:
-                    print('Normalizing column', week, column)
+        # columns unseen when fitting have no sum and are left as they are
+        sums = np.where(indices >= 0, self.column_sums[indices], 0)
+        columns, sums = columns[sums > 0], sums[sums > 0]
+
+        if self.verbose:
+            print('Normalizing %d columns' % len(columns))
 
-                if self.column_sums[(week, column)] > 0:
-                    data[(week, column)] = data[(week, column)].div(self.column_sums[(week, column)]).fillna(0)
+        if len(columns) > 0:
+            values = data[columns].values / sums
+            values[np.isnan(values)] = 0
+            data[columns] = values
 
         return data
 
@@ -122,7 +170,7 @@ class TimeDecayApplier(BaseEstimator, TransformerMixin):
 
         data = data.copy(deep=False)
 
-        for week in data.columns.get_level_values(0):
+        for week in data.columns.get_level_values(0).unique():
             columns_to_process = ['tweets', 'other_hashtags', 'other_mentions', 'other_urls'] if \
                 self.ignore_binarized_columns else \
                 data.loc[:, [week]].columns.get_level_values(1)
@@ -150,8 +198,8 @@ class WeeksLimiter(BaseEstimator, TransformerMixin):
         return self
 
     def transform(self, data):
-        for week in data.columns.get_level_values(0):
-            if week < self.start_week or week >= self.target_week:
-                data = data.drop(week, axis=1)
+        # drop all weeks at once, every drop copies the data
+        weeks = [week for week in data.columns.get_level_values(0).unique()
+                 if week < self.start_week or week >= self.target_week]
 
-        return data
+        return data.drop(weeks, axis=1, level=0) if weeks else data
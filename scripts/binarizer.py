@@ -4,6 +4,9 @@ from datetime import datetime
 from multiprocessing import Pool
 from os import listdir
 from parse import parse
+from timeit import default_timer as timer
+
+import profiling
 
 
 def prepare_dataset():
@@ -14,11 +17,14 @@ def prepare_dataset():
     print('Preparing the dataset')
 
     print('Loading data.csv')
-    data: pd.DataFrame = pd.read_csv('../data/data.csv')
+    with profiling.span('load') as span:
+        data: pd.DataFrame = pd.read_csv('../data/data.csv')
+        span['rows'] = data.shape[0]
 
     # convert timestamps to week numbers
     print('Converting weeks')
-    data['week'] = data['week'].apply(lambda w: datetime.strptime(w, '%Y-%m-%d 00:00:00').isocalendar()[1])
+    with profiling.span('convert weeks', data.shape[0]):
+        data['week'] = data['week'].apply(lambda w: datetime.strptime(w, '%Y-%m-%d 00:00:00').isocalendar()[1])
 
     # drop tweets from 43th week
     data: pd.DataFrame = data[data['week'] < 40]
@@ -29,13 +35,15 @@ def prepare_dataset():
     # process categorical columns
     for c in ['hashtags', 'mentions', 'urls']:
         print('Processing lists in ' + c)
-        data[c] = data[c].apply(lambda s: s[1:-1])
+        with profiling.span('process lists', data.shape[0]):
+            data[c] = data[c].apply(lambda s: s[1:-1])
 
     print('The shape of the data is %d by %d' % data.shape)
 
     # save to a CSV
     print('Saving as prepared_data.csv')
-    data.to_csv('../data/prepared_data.csv', index=False)
+    with profiling.span('save', data.shape[0]):
+        data.to_csv('../data/prepared_data.csv', index=False)
 
 
 def pivot_dataset():
@@ -45,37 +53,45 @@ def pivot_dataset():
 
     # load the data
     print('Loading prepared_data.csv')
-    data: pd.DataFrame = pd.read_csv('../data/prepared_data.csv')
+    with profiling.span('load') as span:
+        data: pd.DataFrame = pd.read_csv('../data/prepared_data.csv')
+        span['rows'] = data.shape[0]
 
     # process categorical columns - split to lists
     for c in ['hashtags', 'mentions', 'urls']:
         print('Processing lists in ' + c)
-        data[c] = data[c].apply(lambda s: s.split(',') if type(s) == str else [])
+        with profiling.span('split lists', data.shape[0]):
+            data[c] = data[c].apply(lambda s: s.split(',') if type(s) == str else [])
 
     # make the pivot table
     print('Making the pivot table')
-    pivot: pd.DataFrame = data.set_index(['user', 'week']).unstack('week')
+    with profiling.span('pivot', data.shape[0]):
+        pivot: pd.DataFrame = data.set_index(['user', 'week']).unstack('week')
     del data
 
     # fill missing tweets
     print('Filling NAs in tweets')
-    pivot['tweets'] = pivot['tweets'].fillna(0)
+    with profiling.span('fill tweets', pivot.shape[0]):
+        pivot['tweets'] = pivot['tweets'].fillna(0)
 
     # process categorical columns again - join back to strings
     for c in ['hashtags', 'mentions', 'urls']:
         print('Processing lists in ' + c)
-        pivot[c] = pivot[c].applymap(lambda s: ','.join(s) if type(s) == list else None)
+        with profiling.span('join lists', pivot.shape[0]):
+            pivot[c] = pivot[c].applymap(lambda s: ','.join(s) if type(s) == list else None)
 
     print('The shape of the pivot table is %d by %d' % pivot.shape)
 
     # save to a CSV
     print('Saving as pivot_data.csv')
-    pivot.to_csv('../data/pivot_data.csv', index=True, index_label='user')
+    with profiling.span('save', pivot.shape[0]):
+        pivot.to_csv('../data/pivot_data.csv', index=True, index_label='user')
 
 
 def process_chunk_week(chunk: pd.SparseDataFrame, chunk_number: int, week: int, min_usage: int):
     """ Asynchronously process the input data which is a
-        certain week of a certain chunk. Save the result to a pickle file. """
+        certain week of a certain chunk. Save the result to a pickle file.
+        Return the recorded spans. """
 
     print('[%d] Processing week %d' % (week, week))
 
@@ -85,57 +101,65 @@ def process_chunk_week(chunk: pd.SparseDataFrame, chunk_number: int, week: int,
 
     # get the dummy columns for hashtags
     print('[%d] Making dummies for hashtags' % week)
-    dummies_hashtags: pd.SparseDataFrame = chunk['hashtags'].apply(
-        lambda v: v.lower() if type(v) == str else '').str.get_dummies(sep=',')
-    dummies_hashtags_values = dummies_hashtags.values
-
-    usage = dummies_hashtags_values.sum(0)
-    high_usage = usage >= min_usage
-    other = dummies_hashtags_values[:, usage < min_usage]
-    dummies_hashtags = pd.SparseDataFrame(dummies_hashtags_values[:, high_usage], dummies_hashtags.index,
-                                          dummies_hashtags.columns[high_usage].map(lambda c: 'hashtag_' + c))
-    dummies_hashtags['other_hashtags'] = other.sum(1)
+    with profiling.span('dummies hashtags', chunk.shape[0]):
+        dummies_hashtags: pd.SparseDataFrame = chunk['hashtags'].apply(
+            lambda v: v.lower() if type(v) == str else '').str.get_dummies(sep=',')
+        dummies_hashtags_values = dummies_hashtags.values
+
+        usage = dummies_hashtags_values.sum(0)
+        high_usage = usage >= min_usage
+        other = dummies_hashtags_values[:, usage < min_usage]
+        dummies_hashtags = pd.SparseDataFrame(dummies_hashtags_values[:, high_usage], dummies_hashtags.index,
+                                              dummies_hashtags.columns[high_usage].map(lambda c: 'hashtag_' + c))
+        dummies_hashtags['other_hashtags'] = other.sum(1)
 
     print('[%d] There are %d hashtag columns' % (week, dummies_hashtags.shape[1]))
 
     # get the dummy columns for mentions
     print('[%d] Making dummies for mentions' % week)
-    dummies_mentions: pd.SparseDataFrame = chunk['mentions'].apply(
-        lambda v: v.lower() if type(v) == str else '').str.get_dummies(sep=',')
-    dummies_mentions_values = dummies_mentions.values
-
-    usage = dummies_mentions_values.sum(0)
-    high_usage = usage >= min_usage
-    other = dummies_mentions_values[:, usage < min_usage]
-    dummies_mentions = pd.SparseDataFrame(dummies_mentions_values[:, high_usage], dummies_mentions.index,
-                                          dummies_mentions.columns[high_usage].map(lambda c: 'mention_' + c))
-    dummies_mentions['other_mentions'] = other.sum(1)
+    with profiling.span('dummies mentions', chunk.shape[0]):
+        dummies_mentions: pd.SparseDataFrame = chunk['mentions'].apply(
+            lambda v: v.lower() if type(v) == str else '').str.get_dummies(sep=',')
+        dummies_mentions_values = dummies_mentions.values
+
+        usage = dummies_mentions_values.sum(0)
+        high_usage = usage >= min_usage
+        other = dummies_mentions_values[:, usage < min_usage]
+        dummies_mentions = pd.SparseDataFrame(dummies_mentions_values[:, high_usage], dummies_mentions.index,
+                                              dummies_mentions.columns[high_usage].map(lambda c: 'mention_' + c))
+        dummies_mentions['other_mentions'] = other.sum(1)
 
     print('[%d] There are %d mention columns' % (week, dummies_mentions.shape[1]))
 
     # get the dummy columns for urls
     print('[%d] Making dummies for urls' % week)
-    dummies_urls: pd.SparseDataFrame = chunk['urls'].apply(
-        lambda v: v.lower() if type(v) == str else '').str.get_dummies(sep=',')
-    dummies_urls_values = dummies_urls.values
-
-    usage = dummies_urls_values.sum(0)
-    high_usage = usage >= min_usage
-    other = dummies_urls_values[:, usage < min_usage]
-    dummies_urls = pd.SparseDataFrame(dummies_urls_values[:, high_usage], dummies_urls.index,
-                                      dummies_urls.columns[high_usage].map(lambda c: 'url_' + c))
-    dummies_urls['other_urls'] = other.sum(1)
+    with profiling.span('dummies urls', chunk.shape[0]):
+        dummies_urls: pd.SparseDataFrame = chunk['urls'].apply(
+            lambda v: v.lower() if type(v) == str else '').str.get_dummies(sep=',')
+        dummies_urls_values = dummies_urls.values
+
+        usage = dummies_urls_values.sum(0)
+        high_usage = usage >= min_usage
+        other = dummies_urls_values[:, usage < min_usage]
+        dummies_urls = pd.SparseDataFrame(dummies_urls_values[:, high_usage], dummies_urls.index,
+                                          dummies_urls.columns[high_usage].map(lambda c: 'url_' + c))
+        dummies_urls['other_urls'] = other.sum(1)
 
     print('[%d] There are %d url columns' % (week, dummies_urls.shape[1]))
 
     # concatenate to one big data frame
     print('[%d] Concatenating dummies and copying tweets' % week)
-    dummies: pd.SparseDataFrame = pd.concat([dummies_hashtags, dummies_mentions, dummies_urls], axis=1)
-    dummies['tweets'] = chunk['tweets']
+    with profiling.span('concat', chunk.shape[0]):
+        dummies: pd.SparseDataFrame = pd.concat([dummies_hashtags, dummies_mentions, dummies_urls], axis=1)
+        dummies['tweets'] = chunk['tweets']
 
     # save to a pickle
     print('[%d] Saving' % week)
-    dummies.to_pickle('../data/chunks/chunk_%d_week_%d.pkl' % (chunk_number, week))
+    with profiling.span('pickle', chunk.shape[0]):
+        dummies.to_pickle('../data/chunks/chunk_%d_week_%d.pkl' % (chunk_number, week))
+
+    # send the spans of this worker back to the main process
+    return profiling.collect()
 
 
 def binarize_dataset():
@@ -146,7 +170,8 @@ def binarize_dataset():
 
     # constants
     chunk_size = 2000
-    total_chunks = 8261630 / chunk_size
+    total_users = 8261630
+    total_chunks = total_users / chunk_size
     min_usage = 10
 
     # read the starting chunk
@@ -169,8 +194,12 @@ def binarize_dataset():
     types = {'tweets': int, 'hashtags': str, 'mentions': str, 'urls': str}
     data_chunks = pd.read_csv('../data/pivot_data.csv', header=[0, 1], index_col=0, chunksize=chunk_size, dtype=types)
 
-    # process all chunks
-    for i, data in enumerate(data_chunks):
+    # for the progress
+    start = timer()
+    processed_chunks = 0
+
+    # process all chunks, reading every chunk is measured as a load span
+    for i, data in enumerate(profiling.iterate('load', data_chunks)):
         # skip chunks before the starting chunk
         if i < starting_chunk:
             print('Skipping chunk %d' % i)
@@ -179,11 +208,13 @@ def binarize_dataset():
         print('\nPROCESSING CHUNK %d of %d\n' % (i, total_chunks))
 
         print('Converting to sparse data frame')
-        data: pd.SparseDataFrame = data.to_sparse(0)
+        with profiling.span('sparse conversion', data.shape[0]):
+            data: pd.SparseDataFrame = data.to_sparse(0)
 
         # swap levels so the week number is the first
         print('Swapping levels')
-        data = data.swaplevel(axis=1).sort_index(1)
+        with profiling.span('swap levels', data.shape[0]):
+            data = data.swaplevel(axis=1).sort_index(1)
 
         # store the minimum and the maximum week number for iterating later
         first_week = int(data.columns.levels[0].min())
@@ -209,11 +240,18 @@ def binarize_dataset():
 
         # wait for the processes before moving to the next chunk
         for process in processes:
-            process.get()
+            profiling.add(process.get())
 
+        # print the progress
+        processed_chunks += 1
+        elapsed = timer() - start
+        remaining = (total_chunks - i - 1) * elapsed / processed_chunks
+        print('Processed %d users in %.1f s, %.1f users per second, %.0f s remaining' %
+              (processed_chunks * chunk_size, elapsed, processed_chunks * chunk_size / elapsed, remaining))
 
-def merge_chunks():
-    """ Merge all created chunks to a single data frame. """
+
+def find_last_chunk():
+    """ Find the last chunk that has all weeks generated. """
 
     # find the last chunk generated
     files = listdir('../data/chunks/')
@@ -237,10 +275,29 @@ def merge_chunks():
                 break
 
         if has_all_weeks:
-            break
+            return last_chunk
         else:
             last_chunk -= 1
 
+
+def load_chunk(chunk_number):
+    """ Load all weeks of a chunk and merge them to a single data frame. """
+
+    weeks = []
+
+    # load weeks and merge them
+    for week in range(23, 37):
+        week_data = pd.read_pickle('../data/chunks/chunk_%d_week_%d.pkl' % (chunk_number, week))
+        weeks.append(week_data)
+
+    return pd.concat(weeks, axis=1, keys=list(range(23, 37)))
+
+
+def merge_chunks():
+    """ Merge all created chunks to a single data frame. """
+
+    last_chunk = find_last_chunk()
+
     print('Merging chunks from 0 to %d' % last_chunk)
 
     data_frames = []
@@ -249,44 +306,44 @@ def merge_chunks():
     for chunk_number in range(last_chunk + 1):
         print('Adding chunk %d' % chunk_number)
 
-        weeks = []
-
-        # load weeks and merge them
-        for week in range(23, 37):
-            week_data = pd.read_pickle('../data/chunks/chunk_%d_week_%d.pkl' % (chunk_number, week))
-            weeks.append(week_data)
-
-        chunk = pd.concat(weeks, axis=1, keys=list(range(23, 37)))
-
         # append to the data
-        data_frames.append(chunk)
+        with profiling.span('load') as span:
+            data_frames.append(load_chunk(chunk_number))
+            span['rows'] = data_frames[-1].shape[0]
 
     # save the data
     print('Concatenating chunks')
-    data: pd.SparseDataFrame = pd.concat(data_frames)
+    with profiling.span('concat') as span:
+        data: pd.SparseDataFrame = pd.concat(data_frames)
+        span['rows'] = data.shape[0]
     print('Saving the data with size %d by %d' % data.shape)
     print('The type of the data is ' + str(type(data)))
 
-    data.fillna(0, inplace=True)
-    data.to_pickle('../data/binarized_data.pkl')
+    with profiling.span('fill NAs', data.shape[0]):
+        data.fillna(0, inplace=True)
+    with profiling.span('pickle', data.shape[0]):
+        data.to_pickle('../data/binarized_data.pkl')
 
 
 if __name__ == '__main__':
-    if len(sys.argv) == 1:
-        # by default, binarize the dataset
-        binarize_dataset()
-
-    elif sys.argv[1] == 'binarize':
-        binarize_dataset()
+    # an optional flag for dumping a cProfile file of the action
+    profile = '--profile' in sys.argv
+    if profile:
+        sys.argv.remove('--profile')
 
-    elif sys.argv[1] == 'prepare':
-        prepare_dataset()
+    # by default, binarize the dataset
+    action = sys.argv[1] if len(sys.argv) >= 2 else 'binarize'
 
-    elif sys.argv[1] == 'pivot':
-        pivot_dataset()
+    actions = {
+        'binarize': binarize_dataset,
+        'prepare': prepare_dataset,
+        'pivot': pivot_dataset,
+        'merge': merge_chunks,
+    }
 
-    elif sys.argv[1] == 'merge':
-        merge_chunks()
+    if action in actions:
+        with profiling.profiled(action, profile):
+            actions[action]()
 
     else:
-        print('Unknown action: ' + sys.argv[1])
+        print('Unknown action: ' + action)
@@ -0,0 +1,154 @@
+"""
+A compact container for the binarized dataset. Instead of a data frame with
+(week, feature) columns, the values are stored in one dense or sparse matrix of
+users by weeks times features. The columns are ordered by week first, so a window
+of weeks is a contiguous block of columns. The week and feature names are kept in
+lookup tables and the container converts to and from the data frames.
+
+The columns are the union of the features of all weeks, so the values are sparse
+by default and the dense matrix is only for small frames. The frames of
+binarized_transforms have (week, feature) columns and the frames of transforms
+have (feature, week) columns, week_level tells which one it is.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+count_features = ['tweets', 'other_hashtags', 'other_mentions', 'other_urls']
+
+feature_prefixes = {'hashtags': 'hashtag_', 'mentions': 'mention_', 'urls': 'url_'}
+
+
+class FeatureTensor:
+    """ Users by weeks by features, stored as a matrix of users by (week, feature) columns. """
+
+    def __init__(self, values, index, weeks, features, target=None):
+        self.values = values
+        self.index = pd.Index(index)
+        self.weeks = np.asarray(weeks)
+        self.features = pd.Index(features)
+        self.target = target
+
+    @classmethod
+    def from_frame(cls, data, use_sparse=True, week_level=0):
+        """ Make a tensor from a data frame with (week, feature) columns, or (feature, week)
+            columns if week_level is 1. Missing combinations of weeks and features are zeros. """
+
+        week_levels = data.columns.get_level_values(week_level)
+        feature_levels = data.columns.get_level_values(1 - week_level)
+
+        weeks = np.array(sorted(set(week_levels)))
+        features = pd.Index(sorted(set(feature_levels)))
+        total = len(weeks) * len(features)
+
+        positions = pd.Index(weeks).get_indexer(week_levels) * len(features) + features.get_indexer(feature_levels)
+
+        if use_sparse:
+            # multiply by a selection matrix, which moves every column to its position
+            selection = sparse.csr_matrix((np.ones(len(positions)), (np.arange(len(positions)), positions)),
+                                          shape=(len(positions), total))
+            matrix = data.to_coo() if hasattr(data, 'to_coo') else data.values
+            values = sparse.csr_matrix(matrix) @ selection
+        else:
+            values = np.zeros((data.shape[0], total))
+            values[:, positions] = data.values
+
+        return cls(values, data.index, weeks, features)
+
+    def to_frame(self, week_level=0):
+        """ Make a data frame with (week, feature) columns, or (feature, week) columns if
+            week_level is 1, and the target, if there is one. """
+
+        columns = self.columns if week_level == 0 else self.columns.swaplevel()
+
+        if sparse.issparse(self.values):
+            data = pd.SparseDataFrame(self.values, self.index, columns, default_fill_value=0)
+        else:
+            data = pd.DataFrame(self.values, self.index, columns)
+
+        if self.target is not None:
+            data = data.assign(target=self.target)
+
+        return data
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    @property
+    def columns(self):
+        """ The (week, feature) pairs in the order of the columns of the values. """
+
+        return pd.MultiIndex.from_product([self.weeks, self.features])
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        values = self.values.toarray() if sparse.issparse(self.values) else self.values
+        return values if dtype is None else values.astype(dtype)
+
+    def __getitem__(self, rows):
+        """ Take a subset of the users. """
+
+        return FeatureTensor(self.values[rows], self.index[rows], self.weeks, self.features,
+                             None if self.target is None else self.target[rows])
+
+    def with_values(self, values):
+        """ Make a tensor with the same users, weeks and features but different values. """
+
+        return FeatureTensor(values, self.index, self.weeks, self.features, self.target)
+
+    def positions(self, weeks=None, features=None):
+        """ Get the positions of the columns of the given weeks and features. All by default. """
+
+        week_positions = np.arange(len(self.weeks)) if weeks is None else pd.Index(self.weeks).get_indexer(weeks)
+        feature_positions = np.arange(len(self.features)) if features is None else self.features.get_indexer(features)
+
+        if (week_positions < 0).any() or (feature_positions < 0).any():
+            raise KeyError('Unknown weeks or features')
+
+        return (week_positions[:, None] * len(self.features) + feature_positions[None, :]).ravel()
+
+    def feature_group(self, group):
+        """ Get the names of the features of a group: counts, hashtags, mentions or urls. """
+
+        if group == 'counts':
+            return [feature for feature in count_features if feature in self.features]
+
+        return list(self.features[self.features.str.startswith(feature_prefixes[group])])
+
+    def week(self, week):
+        """ Get the matrix of users by features of a week. """
+
+        return self.values[:, self.positions(weeks=[week])]
+
+    def select_weeks(self, start_week, end_week):
+        """ Keep only the weeks from start_week to end_week (exclusive). The weeks are a
+            contiguous block of columns, so dense values are not copied. """
+
+        mask = (self.weeks >= start_week) & (self.weeks < end_week)
+        positions = np.flatnonzero(mask)
+
+        if len(positions) == 0:
+            values = self.values[:, :0]
+        else:
+            values = self.values[:, positions[0] * len(self.features):(positions[-1] + 1) * len(self.features)]
+
+        return FeatureTensor(values, self.index, self.weeks[mask], self.features, self.target)
+
+    def select_features(self, features):
+        """ Keep only the given features, e.g. a feature group, in all weeks. """
+
+        return FeatureTensor(self.values[:, self.positions(features=features)], self.index, self.weeks, features,
+                             self.target)
+
+    def scale_columns(self, scale):
+        """ Multiply every column by the matching number in scale. """
+
+        if sparse.issparse(self.values):
+            return self.with_values(sparse.csr_matrix(self.values.multiply(scale)))
+
+        return self.with_values(self.values * scale)
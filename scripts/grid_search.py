@@ -0,0 +1,208 @@
+"""
+Parallel grid search over the tensor_transforms pipelines. The shared
+preprocessing (making the target) is done once. The resulting sparse matrix is
+stored as memory-mapped CSR arrays, together with the fold splits. Workers open
+the arrays read-only and get the folds as views, without copying the rows.
+
+The rows are ordered by fold and the ordering is stored twice, so both the test
+rows and the train rows of every fold are one contiguous range:
+
+    fold 0 | fold 1 | fold 2 | fold 0 | fold 1 | fold 2
+    test 0 |  train 0        |
+             test 1 |  train 1        |
+
+The cache is keyed by the source file (path, modification time and size), the
+target week and the number of folds.
+
+Usage: python grid_search.py [target week] [folds]
+"""
+
+import os
+import sys
+import pickle
+import hashlib
+from multiprocessing import Pool
+from timeit import default_timer as timer
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.base import clone
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import f1_score
+from sklearn.model_selection import ParameterGrid, StratifiedKFold
+from sklearn.pipeline import Pipeline
+from sklearn.utils.class_weight import compute_sample_weight
+
+from feature_tensor import FeatureTensor
+from tensor_transforms import TargetMaker, Normalizer, TimeDecayApplier, WeeksLimiter, MatrixMaker
+
+
+shared = None
+
+
+def cache_directory(source_file, target_week, n_folds, directory='../data/grid_search/'):
+    """ Get the cache directory for the source file. A regenerated source file gets a new one. """
+
+    stat = os.stat(source_file)
+    key = '%s:%d:%d:%d:%d' % (os.path.abspath(source_file), stat.st_mtime_ns, stat.st_size, target_week, n_folds)
+
+    return os.path.join(directory, hashlib.md5(key.encode('utf-8')).hexdigest()[:16])
+
+
+def prepare_shared_data(source_file, target_week, n_folds=3, directory='../data/grid_search/'):
+    """ Make the target, order the rows by fold and save the sparse matrix as memory-mapped
+        CSR arrays. The source file is loaded only when there is no cached data for it. """
+
+    directory = cache_directory(source_file, target_week, n_folds, directory)
+    meta_file = os.path.join(directory, 'meta.pkl')
+
+    if os.path.exists(meta_file):
+        print('Using the cached data in ' + directory)
+        return directory
+
+    os.makedirs(directory, exist_ok=True)
+
+    print('Loading ' + source_file)
+    data = FeatureTensor.from_frame(pd.read_pickle(source_file), use_sparse=True)
+
+    print('Making the target')
+    data = TargetMaker(target_week).transform(data)
+
+    print('Splitting to %d folds' % n_folds)
+    folds = [test_rows for _, test_rows in
+             StratifiedKFold(n_folds, shuffle=True).split(np.zeros(len(data)), data.target)]
+    order = np.concatenate(folds)
+
+    values = sparse.csr_matrix(data.values[order], dtype=np.float32)
+    nnz = values.nnz
+    index_type = np.int32 if 2 * nnz < 2 ** 31 else np.int64
+
+    print('Saving the data with size %d by %d and %d values' % (values.shape[0], values.shape[1], nnz))
+
+    # the ordering twice, the second copy only shifts the row pointers
+    for name, first, second in [('data', values.data, values.data),
+                                ('indices', values.indices, values.indices),
+                                ('indptr', values.indptr, values.indptr[1:].astype(index_type) + nnz)]:
+        array = np.lib.format.open_memmap(os.path.join(directory, name + '.npy'), mode='w+',
+                                          dtype=np.float32 if name == 'data' else index_type,
+                                          shape=(len(first) + len(second),))
+        array[:len(first)] = first
+        array[len(first):] = second
+        array.flush()
+        del array
+
+    starts = np.concatenate([[0], np.cumsum([len(fold) for fold in folds] * 2)])
+
+    # the meta file is written last, it marks the cache as complete
+    with open(meta_file, 'wb') as file:
+        pickle.dump({'columns': values.shape[1], 'weeks': data.weeks, 'features': data.features,
+                     'target': np.concatenate([data.target[order]] * 2), 'starts': starts}, file)
+
+    return directory
+
+
+def init_worker(directory):
+    """ Open the shared arrays once in every worker. """
+
+    global shared
+
+    with open(os.path.join(directory, 'meta.pkl'), 'rb') as file:
+        shared = pickle.load(file)
+
+    for name in ['data', 'indices', 'indptr']:
+        shared[name] = np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+
+def row_view(start, end):
+    """ Get the rows from start to end as a tensor. The values are views of the shared arrays. """
+
+    begin, stop = shared['indptr'][start], shared['indptr'][end]
+    values = sparse.csr_matrix((shared['data'][begin:stop], shared['indices'][begin:stop],
+                                shared['indptr'][start:end + 1] - begin),
+                               shape=(end - start, shared['columns']), copy=False)
+
+    return FeatureTensor(values, pd.RangeIndex(start, end), shared['weeks'], shared['features'],
+                         shared['target'][start:end])
+
+
+def evaluate_candidate(task):
+    """ Fit and score one pipeline on one fold. This function is run by a worker. """
+
+    candidate, fold, pipeline, params, balance = task
+    starts = shared['starts']
+    n_folds = (len(starts) - 1) // 2
+
+    test = row_view(starts[fold], starts[fold + 1])
+    train = row_view(starts[fold + 1], starts[fold + n_folds])
+
+    pipeline = clone(pipeline).set_params(**params)
+
+    # balance the classes by weights, so the train rows don't have to be copied
+    fit_params = {}
+    if balance:
+        fit_params[pipeline.steps[-1][0] + '__sample_weight'] = compute_sample_weight('balanced', train.target)
+
+    start = timer()
+    pipeline.fit(train, train.target, **fit_params)
+    end = timer()
+
+    score = f1_score(test.target, pipeline.predict(test))
+
+    print('Candidate %d fold %d has f1 score %.5f' % (candidate, fold, score))
+
+    return candidate, fold, score, end - start
+
+
+def grid_search(source_file, pipeline, param_grid, target_week, n_folds=3, balance=True, processes=None,
+                directory='../data/grid_search/'):
+    """ Evaluate all parameter combinations of the pipeline with cross validation.
+        Return a data frame with the mean scores and fit times, the best first. """
+
+    directory = prepare_shared_data(source_file, target_week, n_folds, directory)
+    candidates = list(ParameterGrid(param_grid))
+
+    print('Evaluating %d candidates on %d folds' % (len(candidates), n_folds))
+
+    tasks = [(candidate, fold, pipeline, params, balance)
+             for candidate, params in enumerate(candidates)
+             for fold in range(n_folds)]
+
+    with Pool(processes, initializer=init_worker, initargs=(directory,)) as pool:
+        scores = pool.map(evaluate_candidate, tasks)
+
+    scores = pd.DataFrame(scores, columns=['candidate', 'fold', 'f1 score', 'time to train in seconds'])
+    results = scores.groupby('candidate')[['f1 score', 'time to train in seconds']].mean()
+    results['f1 score std'] = scores.groupby('candidate')['f1 score'].std()
+    results['params'] = [candidates[candidate] for candidate in results.index]
+
+    return results.sort_values('f1 score', ascending=False)
+
+
+def main():
+    """ Search the number of weeks, normalization and time decay for the logistic regression. """
+
+    target_week = int(sys.argv[1]) if len(sys.argv) >= 2 else 36
+    n_folds = int(sys.argv[2]) if len(sys.argv) >= 3 else 3
+
+    pipeline = Pipeline([
+        ('limiter', WeeksLimiter(target_week - 3, target_week)),
+        ('normal', Normalizer(ignore_binarized_columns=True)),
+        ('decay', TimeDecayApplier(target_week, ignore_binarized_columns=True)),
+        ('matrix', MatrixMaker()),
+        ('logreg', LogisticRegression(solver='sag'))
+    ])
+
+    param_grid = {
+        'limiter__start_week': [target_week - 3, target_week - 8, target_week - 12],
+        'normal__skip': [False, True],
+        'decay__skip': [False, True],
+    }
+
+    results = grid_search('../data/binarized_data.pkl', pipeline, param_grid, target_week, n_folds)
+
+    pd.set_option('display.max_colwidth', 200)
+    print(results)
+
+
+if __name__ == '__main__':
+    main()
@@ -38,6 +38,67 @@ def write_tweet(filename, tweet_timestamp, tweet_user, tweet_content):
         file.write('\n')
 
 
+class TweetWriter:
+    """
+    A buffered writer of tweets. Keeps the file open and writes the formatted
+    tweets in large blocks. Use the same format as the dataset. If header is set,
+    the file starts with the total line which is filled in when closing.
+    """
+
+    def __init__(self, filename, header = False, buffer_size = 1 << 20):
+        self.file = io.open(filename, mode = 'w' if header else 'a', encoding = 'utf-8')
+        self.header = header
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+        self.count = 0
+
+        # a fixed width placeholder, so it can be overwritten in place
+        if header:
+            self.file.write('total:%012d\n' % 0)
+
+    def write(self, tweet_timestamp, tweet_user, tweet_content):
+        """
+        Add a tweet to the buffer. The timestamp can be a datetime or an already formatted string.
+        """
+        if type(tweet_timestamp) != str:
+            tweet_timestamp = tweet_timestamp.strftime('%Y-%m-%d %H:%M:%S')
+
+        record = 'T\t%s\nU\t%s\nW\t%s\n\n' % (tweet_timestamp, tweet_user, tweet_content)
+        self.buffer.append(record)
+        self.buffered += len(record)
+        self.count += 1
+
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffer to the file.
+        """
+        self.file.write(''.join(self.buffer))
+        self.buffer = []
+        self.buffered = 0
+
+    def close(self):
+        """
+        Write the rest of the buffer, fill in the total line and close the file.
+        """
+        self.flush()
+
+        if self.header:
+            self.file.seek(0)
+            self.file.write('total:%012d\n' % self.count)
+
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
 def read_tweet(file):
     """
     Read and parse a tweet from a file.
@@ -61,6 +122,45 @@ def read_tweet(file):
     return timestamp, user, content
 
 
+def lazy_read_raw_tweets(filename, start = 0, end = None):
+    """
+    A fast lazy generator that reads tweets from a file. Doesn't parse the
+    timestamps and yields the timestamp string, the user line and the content.
+    Can read only a byte range of the file, so one file can be split between
+    workers. A tweet belongs to the range in which its timestamp line starts.
+    """
+    with io.open(filename, mode = 'rb', buffering = 1 << 20) as file:
+        if start > 0:
+            # the partial line belongs to the previous range
+            file.seek(start - 1)
+            position = start - 1 + len(file.readline())
+        else:
+            # skip the total line
+            position = len(file.readline())
+
+        timestamp = None
+        user = None
+
+        for line in file:
+            kind = line[:1]
+
+            if kind == b'T':
+                if end is not None and position >= end:
+                    return
+
+                timestamp = line[2:].rstrip(b'\n').decode('utf-8')
+                user = None
+            elif kind == b'U':
+                user = line[2:].rstrip(b'\n').decode('utf-8')
+            elif kind == b'W' and timestamp is not None and user is not None:
+                yield timestamp, user, line[2:].rstrip(b'\n').decode('utf-8')
+
+                timestamp = None
+                user = None
+
+            position += len(line)
+
+
 def lazy_read_tweets(filename):
     """
     A lazy generator that reads tweets from a file.
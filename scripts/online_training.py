@@ -0,0 +1,261 @@
+"""
+Online training on the binarized dataset. Instead of loading the whole
+binarized_data.pkl into memory, the chunks made by the binarizer are streamed
+one by one and fed to estimators that support partial_fit.
+
+The statistics (normalizer column sums and the vocabulary of dummy columns)
+are fitted over all chunks in advance. Weeks are stored relative to the target
+week, so a saved model can be trained further when a new week arrives.
+
+Every chunk is made into a sparse matrix with the columns of the vocabulary, so
+the memory depends on the number of values, not on the width of the vocabulary.
+Estimators which need dense input (GaussianNB) get it densified in blocks of
+rows with at most max_dense_cells values.
+
+Usage: python online_training.py <sgd|bayes> <start week> <target week> [model file]
+"""
+
+import os
+import sys
+import pickle
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.linear_model import SGDClassifier
+from sklearn.naive_bayes import GaussianNB
+
+import binarizer
+from binarized_transforms import TargetMaker, Normalizer, TimeDecayApplier, WeeksLimiter
+from tensor_transforms import ClassBalancer
+
+
+max_dense_cells = 10 ** 7
+
+
+def iterate_chunks(last_chunk=None):
+    """ A generator that loads the chunks made by the binarizer one by one. """
+
+    if last_chunk is None:
+        last_chunk = binarizer.find_last_chunk()
+
+    for chunk_number in range(last_chunk + 1):
+        yield chunk_number, binarizer.load_chunk(chunk_number).fillna(0)
+
+
+def split_target(chunk, start_week, target_week):
+    """ Make the target column and limit the weeks. Return the features and the target. """
+
+    data = TargetMaker(target_week).transform(chunk)
+    target = data[['target']].values.ravel()
+    features = WeeksLimiter(start_week, target_week).transform(data.drop('target', axis=1))
+
+    return features, target
+
+
+def to_lags(data, target_week):
+    """ Replace the week numbers in the columns with the number of weeks before the target. """
+
+    data = data.copy(deep=False)
+    data.columns = pd.MultiIndex.from_tuples([(target_week - week, column) for week, column in data.columns])
+
+    return data
+
+
+def fit_chunk_statistics(args):
+    """ Fit the normalizer and collect the columns of one chunk. This function is run by a worker. """
+
+    chunk_number, start_week, target_week, ignore_binarized_columns = args
+
+    print('Fitting statistics on chunk %d' % chunk_number)
+
+    chunk = binarizer.load_chunk(chunk_number).fillna(0)
+    features, _ = split_target(chunk, start_week, target_week)
+    normalizer = Normalizer(ignore_binarized_columns=ignore_binarized_columns).fit(features)
+
+    return normalizer, to_lags(features, target_week).columns
+
+
+def fit_statistics(start_week, target_week, ignore_binarized_columns=True, last_chunk=None):
+    """ Go through all chunks in parallel and fit the normalizer and the vocabulary. The
+        statistics of the chunks are merged together. The vocabulary is the union of
+        the columns of all chunks since each chunk has its own dummies. """
+
+    if last_chunk is None:
+        last_chunk = binarizer.find_last_chunk()
+
+    normalizer = Normalizer(ignore_binarized_columns=ignore_binarized_columns)
+    vocabulary = None
+
+    tasks = [(chunk_number, start_week, target_week, ignore_binarized_columns)
+             for chunk_number in range(last_chunk + 1)]
+
+    with Pool() as pool:
+        for chunk_normalizer, columns in pool.imap_unordered(fit_chunk_statistics, tasks):
+            normalizer.merge(chunk_normalizer)
+            vocabulary = columns if vocabulary is None else vocabulary.union(columns)
+
+    return normalizer, vocabulary.sort_values()
+
+
+def transform_chunk(chunk, start_week, target_week, normalizer, positions, ignore_binarized_columns=True):
+    """ Apply the transformers on a chunk using the fitted statistics. Return the features
+        as a sparse matrix with the columns of the vocabulary and the target. The positions
+        map the (lag, column) pairs of the vocabulary to the columns of the matrix. """
+
+    features, target = split_target(chunk, start_week, target_week)
+
+    features = normalizer.transform(features)
+    features = TimeDecayApplier(target_week, ignore_binarized_columns=ignore_binarized_columns).transform(features)
+    features = to_lags(features, target_week)
+
+    # move the values to the columns of the vocabulary, columns not in it are dropped
+    columns = np.array([positions.get(column, -1) for column in features.columns])
+    matrix = sparse.coo_matrix(features.to_coo() if hasattr(features, 'to_coo') else features.values)
+    keep = (columns[matrix.col] >= 0) & (matrix.data != 0)
+
+    features = sparse.csr_matrix((matrix.data[keep], (matrix.row[keep], columns[matrix.col[keep]])),
+                                 shape=(matrix.shape[0], len(positions)))
+
+    return features, np.asarray(target, dtype=bool)
+
+
+def make_estimator(name):
+    """ Make a new estimator that supports partial_fit. """
+
+    if name == 'sgd':
+        return SGDClassifier(loss='log')
+    elif name == 'bayes':
+        return GaussianNB()
+    else:
+        raise ValueError('Unknown estimator: ' + name)
+
+
+def row_blocks(rows, columns):
+    """ Split the rows to blocks which have at most max_dense_cells values when densified. """
+
+    step = max(1, max_dense_cells // max(1, columns))
+
+    for start in range(0, rows, step):
+        yield slice(start, start + step)
+
+
+def fit_chunk(estimator, features, target, classes):
+    """ Train the estimator on a sparse chunk. GaussianNB needs dense input and gets it by blocks. """
+
+    if not isinstance(estimator, GaussianNB):
+        estimator.partial_fit(features, target, classes=classes)
+        return
+
+    for rows in row_blocks(*features.shape):
+        estimator.partial_fit(features[rows].toarray(), target[rows], classes=classes)
+
+
+def score_chunk(estimator, features, target):
+    """ Get the accuracy of the estimator on a sparse chunk. GaussianNB needs dense input and gets it by blocks. """
+
+    if not isinstance(estimator, GaussianNB):
+        return estimator.score(features, target)
+
+    correct = sum(estimator.score(features[rows].toarray(), target[rows]) * len(target[rows])
+                  for rows in row_blocks(*features.shape))
+
+    return correct / len(target)
+
+
+def train(estimator, start_week, target_week, vocabulary=None, balance=True,
+          ignore_binarized_columns=True, last_chunk=None):
+    """ Train the estimator chunk by chunk. If the vocabulary is given (from a model
+        trained before), only the statistics are refitted and the same columns are used.
+        Return the vocabulary and the fitted normalizer. """
+
+    if last_chunk is None:
+        last_chunk = binarizer.find_last_chunk()
+
+    normalizer, new_vocabulary = fit_statistics(start_week, target_week, ignore_binarized_columns, last_chunk)
+    if vocabulary is None:
+        vocabulary = new_vocabulary
+
+    print('Training on %d columns' % len(vocabulary))
+
+    positions = {column: position for position, column in enumerate(vocabulary)}
+    classes = np.array([False, True])
+
+    for chunk_number, chunk in iterate_chunks(last_chunk):
+        features, target = transform_chunk(chunk, start_week, target_week, normalizer, positions,
+                                           ignore_binarized_columns)
+
+        if balance:
+            balancer = ClassBalancer().fit(features, target)
+            rows = np.concatenate([balancer.activeIndices, balancer.inactiveIndices])
+            features, target = features[rows], target[rows]
+
+        # skip chunks without both classes, they would break the balanced sample
+        if features.shape[0] == 0:
+            print('Skipping chunk %d, it has only one class' % chunk_number)
+            continue
+
+        # test on the chunk before training on it
+        if hasattr(estimator, 'classes_'):
+            print('Accuracy on chunk %d is %.5f' % (chunk_number, score_chunk(estimator, features, target)))
+
+        print('Training on chunk %d' % chunk_number)
+        fit_chunk(estimator, features, target, classes)
+
+    return vocabulary, normalizer
+
+
+def lag_column_sums(normalizer, target_week):
+    """ Get the column sums of a fitted normalizer as a series indexed by the weeks before the target. """
+
+    return pd.Series(normalizer.column_sums, pd.MultiIndex.from_tuples(
+        [(target_week - week, column) for week, column in normalizer.columns]))
+
+
+def save_model(filename, estimator, vocabulary, weeks, column_sums, ignore_binarized_columns=True):
+    """ Save the estimator together with the vocabulary, the number of weeks and the
+        column sums of the normalizer (indexed by the weeks before the target). """
+
+    with open(filename, 'wb') as file:
+        pickle.dump({'estimator': estimator, 'vocabulary': vocabulary, 'weeks': weeks, 'column_sums': column_sums,
+                     'ignore_binarized_columns': ignore_binarized_columns}, file)
+
+
+def load_model(filename):
+    """ Load a model saved by save_model. Return a dictionary with the same keys as saved. """
+
+    with open(filename, 'rb') as file:
+        return pickle.load(file)
+
+
+def main():
+    """ Train a new model or continue training a saved model on a new target week. """
+
+    if len(sys.argv) < 4:
+        print(__doc__)
+        return
+
+    estimator_name = sys.argv[1]
+    start_week = int(sys.argv[2])
+    target_week = int(sys.argv[3])
+    model_file = sys.argv[4] if len(sys.argv) >= 5 else '../data/online_model.pkl'
+
+    if os.path.exists(model_file):
+        print('Continuing training of ' + model_file)
+        model = load_model(model_file)
+        estimator, vocabulary = model['estimator'], model['vocabulary']
+
+        # the columns are relative to the target, keep the same number of weeks
+        start_week = target_week - model['weeks']
+    else:
+        estimator = make_estimator(estimator_name)
+        vocabulary = None
+
+    vocabulary, normalizer = train(estimator, start_week, target_week, vocabulary)
+
+    print('Saving the model to ' + model_file)
+    save_model(model_file, estimator, vocabulary, target_week - start_week, lag_column_sums(normalizer, target_week))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""
+Instrumentation for the scripts. Steps are wrapped in spans which record the
+wall time, the CPU time, the throughput, the resident memory at the start and
+the end of the step and the peak memory of the process that ran them so far.
+Failed steps are recorded too, with the error. Workers send their spans back
+to the main process, which prints a summary at the end of an action and
+optionally dumps a cProfile file.
+"""
+
+import io
+import os
+import time
+import resource
+import cProfile
+import contextlib
+from timeit import default_timer as timer
+
+
+spans = []
+
+
+@contextlib.contextmanager
+def span(name, rows=None):
+    """
+    Measure a step. The yielded record can be used to set the number of rows
+    when it is known only after the step, e.g. when loading.
+    """
+    record = {'name': name, 'pid': os.getpid(), 'rows': rows, 'error': None, 'rss_start_mb': current_rss_mb()}
+
+    start_wall = timer()
+    start_cpu = time.process_time()
+
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = type(e).__name__
+        raise
+    finally:
+        record['wall'] = timer() - start_wall
+        record['cpu'] = time.process_time() - start_cpu
+        record['rss_end_mb'] = current_rss_mb()
+        record['process_peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+        spans.append(record)
+
+
+def iterate(name, iterable):
+    """ Iterate and measure getting every item as a span, e.g. reading a file by chunks. """
+
+    iterator = iter(iterable)
+
+    while True:
+        with span(name) as record:
+            item = next(iterator, None)
+            record['rows'] = len(item) if item is not None else 0
+
+        if item is None:
+            return
+
+        yield item
+
+
+def collect():
+    """ Take the recorded spans and clear them. Workers return these to the main process. """
+
+    global spans
+
+    collected, spans = spans, []
+    return collected
+
+
+def add(records):
+    """ Add spans recorded by a worker. """
+
+    if records:
+        spans.extend(records)
+
+
+def current_rss_mb():
+    """ Get the resident memory of the process now. Where /proc is not available, get the peak. """
+
+    try:
+        with io.open('/proc/self/statm') as file:
+            return int(file.read().split()[1]) * resource.getpagesize() / 1024 / 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def reset_peak_rss():
+    """ Reset the peak resident memory of the process, so peak_rss_mb measures from now. Return False if
+        it can't be reset and the peak is of the whole process. """
+
+    try:
+        with io.open('/proc/self/clear_refs', mode='w') as file:
+            file.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """ Get the peak resident memory since the last reset_peak_rss, or of the whole process. """
+
+    try:
+        with io.open('/proc/self/status') as file:
+            for line in file:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def summary():
+    """ Make a text report of the spans grouped by name, in the order they first appeared. """
+
+    names = []
+    for record in spans:
+        if record['name'] not in names:
+            names.append(record['name'])
+
+    lines = ['%-40s %6s %6s %10s %10s %14s %12s %10s' %
+             ('span', 'count', 'failed', 'wall s', 'cpu s', 'rows per s', 'RSS grow MB', 'RSS MB')]
+
+    for name in names:
+        records = [record for record in spans if record['name'] == name]
+        failed = sum(1 for record in records if record['error'])
+        wall = sum(record['wall'] for record in records)
+        cpu = sum(record['cpu'] for record in records)
+        rows = sum(record['rows'] or 0 for record in records)
+        growth = max(record['rss_end_mb'] - record['rss_start_mb'] for record in records)
+        rss = max(record['rss_end_mb'] for record in records)
+
+        lines.append('%-40s %6d %6d %10.3f %10.3f %14s %+12.1f %10.1f' %
+                     (name, len(records), failed, wall, cpu, '%.1f' % (rows / wall) if rows and wall > 0 else '-',
+                      growth, rss))
+
+    workers = sorted(set(record['pid'] for record in spans))
+    lines.append('')
+    lines.append('Peak memory per process:')
+    for pid in workers:
+        lines.append('  [%d] %.1f MB' %
+                     (pid, max(record['process_peak_rss_mb'] for record in spans if record['pid'] == pid)))
+
+    errors = [record for record in spans if record['error']]
+    if errors:
+        lines.append('')
+        lines.append('Failed spans:')
+        for record in errors:
+            lines.append('  [%d] %s: %s' % (record['pid'], record['name'], record['error']))
+
+    return '\n'.join(lines)
+
+
+@contextlib.contextmanager
+def profiled(action, profile=False, directory='../data/profiles/'):
+    """ Instrument a whole action. Write the summary and optionally a cProfile dump when it ends. """
+
+    os.makedirs(directory, exist_ok=True)
+
+    profiler = cProfile.Profile() if profile else None
+    if profiler:
+        profiler.enable()
+
+    try:
+        with span(action):
+            yield
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(directory, '%s.prof' % action))
+            print('Saved the profile to %s.prof' % os.path.join(directory, action))
+
+        report = summary()
+        print('\n' + report)
+
+        with io.open(os.path.join(directory, '%s_summary.txt' % action), mode='w') as file:
+            file.write(report + '\n')
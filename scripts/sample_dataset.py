@@ -0,0 +1,116 @@
+"""
+Make a reduced dataset for quick experiments. Reads the dataset files with the
+fast reader, keeps the tweets that pass the filters and writes them with the
+buffered writer. The input files are split to byte ranges of about the same
+size, at least one per file, so a single large dump is sampled by all workers.
+Every range is written to its own shard, in the same format as the dataset.
+
+Usage: python sample_dataset.py [options] <output> <input files...>
+"""
+
+import os
+import zlib
+import argparse
+import multiprocessing as mp
+
+import helpers
+
+
+def make_filter(users = None, date_from = None, date_to = None, rate = None):
+    """
+    Make a function which decides if a tweet is kept. The dates are compared as
+    strings, so the timestamps don't have to be parsed. The rate samples users, not
+    tweets, so all tweets of a sampled user are kept.
+    """
+    def keep(timestamp, user):
+        if date_from is not None and timestamp < date_from:
+            return False
+        if date_to is not None and timestamp >= date_to:
+            return False
+
+        name = user[(user.rfind('/') + 1):]
+
+        if users is not None and name not in users:
+            return False
+
+        # the same hash in all workers, unlike the built-in hash
+        if rate is not None and zlib.crc32(name.encode('utf-8')) % 1000000 >= rate * 1000000:
+            return False
+
+        return True
+
+    return keep
+
+
+def split_inputs(inputs, shards):
+    """
+    Split the input files to byte ranges of about the same size. The reader
+    aligns the ranges to the tweets.
+    """
+    sizes = [os.path.getsize(input_file) for input_file in inputs]
+    part_size = max(1, sum(sizes) // shards)
+
+    ranges = []
+    for input_file, size in zip(inputs, sizes):
+        parts = max(1, round(size / part_size))
+        bounds = [size * part // parts for part in range(parts + 1)]
+        ranges.extend((input_file, start, end) for start, end in zip(bounds[:-1], bounds[1:]))
+
+    return ranges
+
+
+def sample_range(task):
+    """
+    Sample one byte range of an input file to one output shard. This function is run by a worker.
+    """
+    input_file, start, end, output_file, users, date_from, date_to, rate = task
+
+    keep = make_filter(users, date_from, date_to, rate)
+    total = 0
+
+    with helpers.TweetWriter(output_file, header = True) as writer:
+        for timestamp, user, content in helpers.lazy_read_raw_tweets(input_file, start, end):
+            total += 1
+
+            if keep(timestamp, user):
+                writer.write(timestamp, user, content)
+
+        kept = writer.count
+
+    helpers.log('Kept %d of %d tweets from %s [%d, %d) in %s' % (kept, total, input_file, start, end, output_file))
+
+    return kept, total
+
+
+def main():
+    """
+    Sample all input files in parallel and show final statistics.
+    """
+    parser = argparse.ArgumentParser(description = 'Make a reduced dataset for quick experiments.')
+    parser.add_argument('output', help = 'the output file, shards are suffixed with their number')
+    parser.add_argument('inputs', nargs = '+', help = 'the dataset files')
+    parser.add_argument('--users', help = 'a file with user names to keep, one per line')
+    parser.add_argument('--from', dest = 'date_from', help = 'keep tweets from this date (YYYY-MM-DD)')
+    parser.add_argument('--to', dest = 'date_to', help = 'keep tweets before this date (YYYY-MM-DD)')
+    parser.add_argument('--rate', type = float, help = 'the fraction of users to keep')
+    parser.add_argument('--shards', type = int, default = mp.cpu_count(),
+                        help = 'the number of parts to split the inputs to (default: number of CPUs)')
+    args = parser.parse_args()
+
+    users = None
+    if args.users:
+        users = set(line.strip() for line in helpers.lazy_read_file(args.users) if line.strip())
+
+    tasks = [(input_file, start, end, '%s.%d' % (args.output, shard), users, args.date_from, args.date_to, args.rate)
+             for shard, (input_file, start, end) in enumerate(split_inputs(args.inputs, args.shards))]
+
+    with mp.Pool(min(len(tasks), mp.cpu_count())) as pool:
+        results = pool.map(sample_range, tasks)
+
+    helpers.log('Written shards: %d' % len(results))
+    helpers.log('Kept tweets: %d' % sum(kept for kept, _ in results))
+    helpers.log('Read tweets: %d' % sum(total for _, total in results))
+
+
+if __name__ == '__main__':
+    main()
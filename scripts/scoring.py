@@ -0,0 +1,268 @@
+"""
+Batch scoring of the user activity. Loads a model saved by online_training once
+and keeps it in memory, then scores batches of users' weekly aggregates read from
+a file or from the database. The features of a whole batch are built into one
+sparse matrix and scaled by a precomputed vector (normalization and time decay), so
+there are no per-column pandas operations and the memory depends on the number of
+values, not on the width of the vocabulary. Estimators which need dense input get
+the matrix densified in blocks of rows, the same way as in online_training.
+
+Usage: python scoring.py <target week> file <aggregates.csv> [output.csv]
+       python scoring.py <target week> db [output.csv]
+       python scoring.py <target week> serve
+
+The file has the same columns as prepared_data.csv (user, week, tweets, hashtags,
+mentions, urls) and must be sorted by user. In the serve mode, input file names are
+read from the standard input, one per line.
+"""
+
+import sys
+import numpy as np
+import pandas as pd
+import psycopg2 as pg
+from scipy import sparse
+from timeit import default_timer as timer
+
+import helpers
+import online_training
+
+
+count_columns = ['tweets', 'other_hashtags', 'other_mentions', 'other_urls']
+
+
+class Scorer:
+    """ Keeps a trained model with its statistics and scores batches of users. """
+
+    def __init__(self, model_file, target_week):
+        model = online_training.load_model(model_file)
+
+        self.estimator = model['estimator']
+        self.vocabulary = model['vocabulary']
+        self.weeks = model['weeks']
+        self.target_week = target_week
+        self.positions = {column: position for position, column in enumerate(self.vocabulary)}
+
+        # the normalization and the time decay are both divisions of the count columns
+        column_sums = model['column_sums'].reindex(self.vocabulary).fillna(0).values
+        self.scale = np.ones(len(self.vocabulary), dtype=np.float32)
+        self.is_dummy = np.array([column not in count_columns for _, column in self.vocabulary], dtype=bool)
+
+        for position, (lag, column) in enumerate(self.vocabulary):
+            if model['ignore_binarized_columns'] and self.is_dummy[position]:
+                continue
+
+            divider = np.sqrt(max(1, lag))
+            if column_sums[position] > 0:
+                divider *= column_sums[position]
+
+            self.scale[position] = 1 / divider
+
+        # set when the estimator refuses sparse input
+        self.dense_input = False
+
+        self.reset_metrics()
+
+    def make_features(self, rows):
+        """ Make the sparse feature matrix from the rows of weekly aggregates. Return the users and the matrix. """
+
+        users = []
+        user_rows = {}
+        cells, columns, cell_values = [], [], []
+
+        for user, week, tweets, hashtags, mentions, urls in rows:
+            if user not in user_rows:
+                user_rows[user] = len(users)
+                users.append(user)
+
+            lag = self.target_week - week
+            if lag < 1 or lag > self.weeks:
+                continue
+
+            row = user_rows[user]
+
+            position = self.positions.get((lag, 'tweets'))
+            if position is not None:
+                cells.append(row)
+                columns.append(position)
+                cell_values.append(tweets)
+
+            for values, prefix, other in [(hashtags, 'hashtag_', 'other_hashtags'),
+                                          (mentions, 'mention_', 'other_mentions'),
+                                          (urls, 'url_', 'other_urls')]:
+                for value in split_list(values):
+                    position = self.positions.get((lag, prefix + value))
+                    if position is None:
+                        position = self.positions.get((lag, other))
+                    if position is not None:
+                        cells.append(row)
+                        columns.append(position)
+                        cell_values.append(1)
+
+        # duplicate triples are summed, the dummy columns stay binary
+        features = sparse.csr_matrix((np.array(cell_values, dtype=np.float32), (cells, columns)),
+                                     shape=(len(users), len(self.vocabulary)))
+        features.sum_duplicates()
+        features.data[self.is_dummy[features.indices]] = 1
+
+        return users, features
+
+    def predict(self, features):
+        """ Get the probabilities of being active. Densify the matrix in parts if the estimator needs it. """
+
+        if not self.dense_input:
+            try:
+                return self.estimator.predict_proba(features)[:, 1]
+            except TypeError:
+                helpers.log('The estimator needs dense input, densifying the batches')
+                self.dense_input = True
+
+        return np.concatenate([self.estimator.predict_proba(features[rows].toarray())[:, 1]
+                               for rows in online_training.row_blocks(*features.shape)])
+
+    def score(self, rows):
+        """ Score a batch of rows. Return a series with the probabilities of being active. """
+
+        start = timer()
+
+        users, features = self.make_features(rows)
+        probabilities = self.predict(features @ sparse.diags(self.scale)) if users else []
+
+        self.latencies.append(timer() - start)
+        self.users += len(users)
+
+        return pd.Series(probabilities, users, name='probability')
+
+    def reset_metrics(self):
+        """ Forget the scored batches, so the metrics start from now. """
+
+        self.latencies = []
+        self.users = 0
+
+    def metrics(self):
+        """ Get the latency and throughput metrics of the batches scored since the last reset. """
+
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        total = latencies.sum()
+
+        return {
+            'batches': len(self.latencies),
+            'users': self.users,
+            'total seconds': total,
+            'users per second': self.users / total if total > 0 else 0,
+            'latency p50': np.percentile(latencies, 50),
+            'latency p95': np.percentile(latencies, 95),
+            'latency p99': np.percentile(latencies, 99),
+        }
+
+
+def split_list(values):
+    """ Split the hashtags, mentions or urls to a list of lowercase values. """
+
+    if type(values) == str:
+        values = values.split(',')
+    elif type(values) != list:
+        return []
+
+    return set(value.lower() for value in values if value)
+
+
+def iterate_user_batches(rows, batch_size):
+    """ Group rows sorted by user to batches of at most batch_size users. """
+
+    batch = []
+    users = 0
+    last_user = None
+
+    for row in rows:
+        if row[0] != last_user:
+            if users == batch_size:
+                yield batch
+                batch = []
+                users = 0
+
+            last_user = row[0]
+            users += 1
+
+        batch.append(row)
+
+    if batch:
+        yield batch
+
+
+def read_file_rows(filename):
+    """ A lazy generator of the rows of a file with weekly aggregates. """
+
+    columns = ['user', 'week', 'tweets', 'hashtags', 'mentions', 'urls']
+    for chunk in pd.read_csv(filename, usecols=columns, chunksize=100000):
+        yield from chunk[columns].itertuples(index=False, name=None)
+
+
+def read_database_rows(first_week):
+    """ A lazy generator of the rows of the grouped_tweets view, starting with the first week. """
+
+    db = pg.connect(host='localhost')
+
+    # a named cursor keeps the rows on the server and fetches them lazily
+    cur = db.cursor('scoring')
+    cur.itersize = 100000
+    cur.execute('SELECT "user", week, tweets, hashtags, mentions, urls FROM grouped_tweets '
+                'WHERE EXTRACT(WEEK FROM week) >= %s ORDER BY "user"', (first_week,))
+
+    for user, week, tweets, hashtags, mentions, urls in cur:
+        yield user, week.isocalendar()[1], tweets, hashtags, mentions, urls
+
+    db.close()
+
+
+def score_rows(scorer, rows, output_file=None, batch_size=10000):
+    """ Score all rows in batches and write the probabilities to the output file. The metrics
+        are of these rows only, the scorer may be kept for more requests. """
+
+    scorer.reset_metrics()
+
+    header = True
+    for batch in iterate_user_batches(rows, batch_size):
+        probabilities = scorer.score(batch)
+
+        if output_file is not None:
+            probabilities.to_csv(output_file, mode='w' if header else 'a', header=header, index_label='user')
+            header = False
+
+    for name, value in scorer.metrics().items():
+        helpers.log('%s: %s' % (name, value))
+
+
+def main():
+    """ Load the model once and score the users from a file, the database or from multiple files. """
+
+    if len(sys.argv) < 3:
+        print(__doc__)
+        return
+
+    target_week = int(sys.argv[1])
+    action = sys.argv[2]
+
+    helpers.log('Loading the model')
+    scorer = Scorer('../data/online_model.pkl', target_week)
+
+    if action == 'file':
+        score_rows(scorer, read_file_rows(sys.argv[3]), sys.argv[4] if len(sys.argv) >= 5 else None)
+
+    elif action == 'db':
+        rows = read_database_rows(target_week - scorer.weeks)
+        score_rows(scorer, rows, sys.argv[3] if len(sys.argv) >= 4 else None)
+
+    elif action == 'serve':
+        # the model stays loaded between the requests
+        for line in sys.stdin:
+            filename = line.strip()
+            if filename:
+                helpers.log('Scoring ' + filename)
+                score_rows(scorer, read_file_rows(filename), filename + '.scores.csv')
+
+    else:
+        print('Unknown action: ' + action)
+
+
+if __name__ == '__main__':
+    main()
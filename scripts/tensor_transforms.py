@@ -0,0 +1,158 @@
+"""
+This module has custom Scikit-learn transformers for making
+pipelines and doing grid search. These are the same as the ones in
+binarized_transforms but work with a FeatureTensor instead of a data frame,
+so every step is a few array operations instead of a loop over columns.
+
+The pipelines of transforms work on frames with (feature, week) columns and
+only count features. These make a tensor with FeatureTensor.from_frame(data,
+week_level=1) and use the transformers here with ignore_binarized_columns=False
+(the first_week of WeeksLimiter is the start_week here). The Normalizer divides
+by the sums of the fitted data, not of the transformed data, so the test data
+is normalized by the train sums.
+"""
+
+import numpy as np
+from scipy import sparse
+from sklearn.base import BaseEstimator, TransformerMixin
+
+import binarized_transforms
+from feature_tensor import FeatureTensor, count_features
+
+
+class TargetMaker(BaseEstimator, TransformerMixin):
+    """ Makes the target from the target week and drops the week. The target
+        is stored in the target attribute of the tensor. """
+
+    def __init__(self, target_week):
+        self.target_week = target_week
+
+    def fit(self, data, target=None):
+        return self
+
+    def transform(self, data):
+        column = data.values[:, data.positions(weeks=[self.target_week], features=['tweets'])]
+        target = (column.toarray() if sparse.issparse(column) else column).ravel() > 0
+
+        weeks = data.weeks[data.weeks != self.target_week]
+
+        return FeatureTensor(data.values[:, data.positions(weeks=weeks)], data.index, weeks, data.features, target)
+
+
+class ClassBalancer(BaseEstimator, TransformerMixin):
+    """ Balances the dataset so both classes have the same amount. """
+
+    def __init__(self):
+        self.activeIndices = []
+        self.inactiveIndices = []
+
+    def fit(self, data, target):
+        # split classes
+        active = np.flatnonzero(target)
+        inactive = np.flatnonzero(~target)
+
+        # sample
+        if active.shape[0] > inactive.shape[0]:
+            active = np.random.choice(active, inactive.shape[0], replace=False)
+        else:
+            inactive = np.random.choice(inactive, active.shape[0], replace=False)
+
+        # store indices
+        self.activeIndices = active
+        self.inactiveIndices = inactive
+
+        return self
+
+    def transform(self, data):
+        # take only stored indices
+        return data[np.concatenate([self.activeIndices, self.inactiveIndices])]
+
+
+class Normalizer(binarized_transforms.Normalizer):
+    """ Normalizes the dataset so the sums per week are 1. Only normalizes
+        columns that contain actual counts and ignores the binary columns.
+        The statistics are the same as in binarized_transforms and can be merged. """
+
+    def columns_to_process(self, data):
+        """ Get the positions of the columns that should be normalized. """
+
+        if not self.ignore_binarized_columns:
+            return np.arange(data.shape[1])
+
+        return data.positions(features=data.feature_group('counts'))
+
+    def partial_fit(self, data, target=None):
+        if self.skip:
+            return self
+
+        positions = self.columns_to_process(data)
+        sums = np.asarray(data.values[:, positions].sum(0), dtype=float).ravel()
+
+        return self.add_sums(data.columns[positions], sums)
+
+    def transform(self, data):
+        if self.skip:
+            return data
+
+        positions = self.columns_to_process(data)
+        indices = self.columns.get_indexer(data.columns[positions])
+
+        # columns unseen when fitting have no sum and are left as they are
+        sums = np.where(indices >= 0, self.column_sums[indices], 0)
+        positions, sums = positions[sums > 0], sums[sums > 0]
+
+        scale = np.ones(data.shape[1])
+        scale[positions] = 1 / sums
+
+        return data.scale_columns(scale)
+
+
+class TimeDecayApplier(BaseEstimator, TransformerMixin):
+    """ Apply a time decay on the data. Weeks that occurred
+        further before the target will have less power. Ignore categorical columns. """
+
+    def __init__(self, target_week, ignore_binarized_columns=True, skip=False):
+        self.target_week = target_week
+        self.ignore_binarized_columns = ignore_binarized_columns
+        self.skip = skip
+
+    def fit(self, data, target=None):
+        return self
+
+    def transform(self, data):
+        if self.skip:
+            return data
+
+        time_decay = np.sqrt(np.maximum(1, self.target_week - data.weeks))
+        scale = np.repeat(1 / time_decay, len(data.features))
+
+        if self.ignore_binarized_columns:
+            is_count = data.features.isin(count_features)
+            scale[~np.tile(is_count, len(data.weeks))] = 1
+
+        return data.scale_columns(scale)
+
+
+class WeeksLimiter(BaseEstimator, TransformerMixin):
+    """ Leave only a certain number of weeks in the dataset.
+        Also drop all weeks after the target. """
+
+    def __init__(self, start_week, target_week):
+        self.start_week = start_week
+        self.target_week = target_week
+
+    def fit(self, data, target=None):
+        return self
+
+    def transform(self, data):
+        return data.select_weeks(self.start_week, self.target_week)
+
+
+class MatrixMaker(BaseEstimator, TransformerMixin):
+    """ Take the values out of the tensor, dense or sparse, for the estimator. """
+
+    def fit(self, data, target=None):
+        return self
+
+    def transform(self, data):
+        return data.values